@@ -13,26 +13,47 @@ oid       : uint64  • order_reference_number
 side      : uint8   • 1 = buy, 0 = sell, 255 = N/A (exec/cancel/delete/replace)
 px        : uint32  • price × 10⁻⁴ USD (0 if not present)
 qty       : uint32  • shares/contracts (0 if not present)
-m         : string  • single-char message type
-stock     : string  • ticker symbol (dict-encoded, near-free)
-new_oid   : uint64  • new_order_reference_number (U-messages); 0 otherwise
-new_px    : uint32  • replacement price; 0 otherwise
-new_qty   : uint32  • replacement shares; 0 otherwise
+m         : dict<uint8, string>   • single-char message type
+stock     : dict<uint16, string>  • ticker symbol (space-stripped)
+
+Replace details live in a sidecar, ``<out>.replace.parquet``, with one row
+per U-message (they are zero for every other row, so inlining them would
+add 16 bytes to each):
+
+row       : uint64  • index of the U-message in the main file
+new_oid   : uint64  • new_order_reference_number
+new_px    : uint32  • replacement price
+new_qty   : uint32  • replacement shares
 
 Usage
 -----
-  pip install itchfeed pyarrow tqdm
+  pip install itchfeed pyarrow numpy numba tqdm   # + rapidgzip (optional, .gz)
   python itch_to_parquet.py 20190530.BX_ITCH_50.gz  bx_20190530.parquet
   python itch_to_parquet.py raw.ITCH out.parquet --symbol AAPL
+  python itch_to_parquet.py raw.ITCH out.parquet --parser itchfeed   # reference
+  python itch_to_parquet.py --self-check     # native vs itchfeed, synthetic data
+
+The default *native* parser decodes the framed binary records directly in a
+Numba-compiled loop (raw files are mmap'd); *itchfeed* goes through message
+objects and is kept as a slow reference for cross-checking.
 """
 
 from __future__ import annotations
-import argparse, gzip, pathlib, sys, typing as t, time, os
-from collections import defaultdict
+import argparse, gzip, pathlib, queue, random, struct, sys, tempfile, threading, typing as t, time, os
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import numpy as np
+from numba import jit, types
+from numba.typed import Dict as NumbaDict
 import pyarrow as pa, pyarrow.parquet as pq
 from tqdm import tqdm
 from itch.parser import MessageParser
 
+try:                    # optional: multi-threaded Deflate for .gz sessions
+    import rapidgzip
+except ImportError:
+    rapidgzip = None
+
 # ──────────────────────────── robust class lookup ───────────────────────────
 def _try(names: list[str]) -> type | None:
     """Return the first present itch.messages class from *names* list."""
@@ -66,125 +87,551 @@ _ORDER_MSGS: tuple[type] = tuple(
 if not _ORDER_MSGS:
     sys.exit("✖  itchfeed API drifted — update the class list.")
 
-# ─────────────────────────── helper field extractors ────────────────────────
-def _side(msg) -> int:
-    bs = getattr(msg, "buy_sell_indicator", None)
-    return 255 if bs is None else (1 if bs == b'B' else 0)
-
-def _price(msg) -> int:
-    for f in ("price", "execution_price", "execution_price_old",
-              "execution_price_new"):
-        p = getattr(msg, f, None)
-        if p is not None:
-            return p
-    return 0
-
-def _qty(msg) -> int:
-    for f in ("shares", "executed_shares", "quantity", "shares_remaining"):
-        q = getattr(msg, f, None)
-        if q is not None:
-            return q
-    return 0
+def _leaf_classes(cls: type) -> set[type]:
+    """*cls* plus every subclass (itchfeed emits e.g. AddOrderNoMPIAttributionMessage)."""
+    out = {cls}
+    for sub in cls.__subclasses__():
+        out |= _leaf_classes(sub)
+    return out
 
-# ─────────────────────────────  main decoder  ───────────────────────────────
+# ─────────────────────────── per-class field table ──────────────────────────
+# (class, price attr, qty attr, has buy_sell_indicator) — one direct attribute
+# access per column instead of scanning candidate names on every message.
+_FIELD_SPEC = (
+    (AddOrderMessage,            "price",           "shares",          True),
+    (AddOrderMPIDAttrib,         "price",           "shares",          True),
+    (OrderExecutedMessage,       None,              "executed_shares", False),
+    (OrderExecutedWithPxMessage, "execution_price", "executed_shares", False),
+    (OrderCancelMessage,         None,              None,              False),
+    (OrderDeleteMessage,         None,              None,              False),
+    (OrderReplaceMessage,        "price",           "shares",          False),
+    (NonCrossTradeMessage,       "price",           "shares",          True),
+    (CrossTradeMessage,          None,              "shares",          False),
+)
+
+# buy_sell_indicator byte → side column (1 = buy, 0 = sell, 255 = N/A);
+# a single indexed load instead of a compare-and-branch per message
+_SIDE_LUT = np.full(256, 255, np.uint8)
+_SIDE_LUT[ord("B")] = 1
+_SIDE_LUT[ord("S")] = 0
+_SIDE_OF = _SIDE_LUT.tobytes()     # same table, int-indexed from pure Python
+
+# exact type → fields; doubles as the hot-loop filter (one hash probe, no MRO)
+_FIELDS: dict[type, tuple[str | None, str | None, bool]] = {
+    leaf: (pxf, qf, has_side)
+    for cls, pxf, qf, has_side in _FIELD_SPEC if cls
+    for leaf in _leaf_classes(cls)
+}
+
+# ───────────────────────────── chunk buffers ────────────────────────────────
+CHUNK = 1 << 20     # rows per RecordBatch (default; main() uses --row-group)
+WRITE_BUFFERS = 3   # one being decoded into, the rest queued for / in the writer
+
+SCHEMA = pa.schema([
+    ("ts",      pa.uint64()),
+    ("oid",     pa.uint64()),
+    ("side",    pa.uint8()),
+    ("px",      pa.uint32()),
+    ("qty",     pa.uint32()),
+    ("m",       pa.dictionary(pa.uint8(),  pa.string())),
+    ("stock",   pa.dictionary(pa.uint16(), pa.string())),
+])
+
+REPLACE_SCHEMA = pa.schema([
+    ("row",     pa.uint64()),
+    ("new_oid", pa.uint64()),
+    ("new_px",  pa.uint32()),
+    ("new_qty", pa.uint32()),
+])
+
+def replace_path(out: pathlib.Path) -> pathlib.Path:
+    """Sidecar file holding the U-message details of *out*."""
+    return out.with_suffix(".replace.parquet")
+
+def np_to_arrow(arr: np.ndarray, pa_type: pa.DataType) -> pa.Array:
+    """Wrap a contiguous NumPy array as a null-free Arrow array, without copying.
+
+    The Arrow buffer holds a reference to *arr*, so it stays alive as long
+    as the array (and any RecordBatch built from it) does.
+    """
+    return pa.Array.from_buffers(pa_type, len(arr), [None, pa.py_buffer(arr)])
+
+@dataclass
+class ChunkBuffer:
+    """Preallocated column buffers for one RecordBatch, filled by row index."""
+    size: int = CHUNK
+    ts:      np.ndarray = field(init=False)
+    oid:     np.ndarray = field(init=False)
+    side:    np.ndarray = field(init=False)
+    px:      np.ndarray = field(init=False)
+    qty:     np.ndarray = field(init=False)
+    m:       np.ndarray = field(init=False)     # codes into m_values
+    stock:   np.ndarray = field(init=False)     # codes into stock_values
+    u_row:   np.ndarray = field(init=False)     # U-messages only, in row order
+    new_oid: np.ndarray = field(init=False)
+    new_px:  np.ndarray = field(init=False)
+    new_qty: np.ndarray = field(init=False)
+
+    def __post_init__(self) -> None:
+        n = self.size
+        self.ts      = np.empty(n, np.uint64)
+        self.oid     = np.empty(n, np.uint64)
+        self.side    = np.empty(n, np.uint8)
+        self.px      = np.empty(n, np.uint32)
+        self.qty     = np.empty(n, np.uint32)
+        self.m       = np.empty(n, np.uint8)
+        self.stock   = np.empty(n, np.uint16)
+        self.u_row   = np.empty(n, np.uint64)
+        self.new_oid = np.empty(n, np.uint64)
+        self.new_px  = np.empty(n, np.uint32)
+        self.new_qty = np.empty(n, np.uint32)
+
+    def to_batch(self, n: int, m_values: list[str],
+                 stock_values: list[str]) -> pa.RecordBatch:
+        """Wrap the first *n* rows as a RecordBatch (zero-copy for NumPy columns).
+
+        *m_values* / *stock_values* are the intern tables the code columns
+        index into; they only ever grow, so codes are stable across batches.
+        """
+        return pa.RecordBatch.from_arrays(
+            [
+                np_to_arrow(self.ts[:n],         pa.uint64()),
+                np_to_arrow(self.oid[:n],        pa.uint64()),
+                np_to_arrow(self.side[:n],       pa.uint8()),
+                np_to_arrow(self.px[:n],         pa.uint32()),
+                np_to_arrow(self.qty[:n],        pa.uint32()),
+                pa.DictionaryArray.from_arrays(
+                    np_to_arrow(self.m[:n],     pa.uint8()),
+                    pa.array(m_values,          pa.string())),
+                pa.DictionaryArray.from_arrays(
+                    np_to_arrow(self.stock[:n], pa.uint16()),
+                    pa.array(stock_values,      pa.string())),
+            ],
+            schema=SCHEMA,
+        )
+
+    def replace_batch(self, u: int, first_row: int) -> pa.RecordBatch:
+        """The first *u* U-messages, rows offset by *first_row* (the batch start)."""
+        return pa.RecordBatch.from_arrays(
+            [
+                np_to_arrow(self.u_row[:u] + np.uint64(first_row), pa.uint64()),
+                np_to_arrow(self.new_oid[:u],    pa.uint64()),
+                np_to_arrow(self.new_px[:u],     pa.uint32()),
+                np_to_arrow(self.new_qty[:u],    pa.uint32()),
+            ],
+            schema=REPLACE_SCHEMA,
+        )
+
+# ──────────────────────────────── input ─────────────────────────────────────
+def _drop_index(index: pathlib.Path) -> None:
+    """Remove a stale rapidgzip index (left in place if the dir is read-only)."""
+    try:
+        index.unlink(missing_ok=True)
+    except OSError:
+        pass
+
+@contextmanager
+def _open_itch(path: pathlib.Path) -> t.Iterator[t.BinaryIO]:
+    """Open an ITCH session for binary reads, decompressing .gz input.
+
+    With rapidgzip installed, Deflate blocks are inflated on all cores and
+    the seek-point index is cached as ``<file>.gzindex`` so re-runs skip the
+    initial serial pass; otherwise falls back to single-threaded gzip.
+    """
+    if path.suffix != ".gz":
+        with open(path, "rb") as fh:
+            yield fh
+    elif rapidgzip is None:
+        with gzip.open(path, "rb") as fh:
+            yield fh
+    else:
+        index = path.with_name(path.name + ".gzindex")
+        if index.exists() and index.stat().st_mtime < path.stat().st_mtime:
+            _drop_index(index)          # .gz replaced since the index was built
+        fh = rapidgzip.RapidgzipFile(str(path), parallelization=0)
+        cached = index.exists()
+        if cached:
+            try:
+                fh.import_index(str(index))
+            except (ValueError, RuntimeError):   # stale or corrupt: rebuild it
+                fh.close()
+                _drop_index(index)
+                cached = False
+                fh = rapidgzip.RapidgzipFile(str(path), parallelization=0)
+        with fh:
+            try:
+                yield fh
+            finally:
+                # decoders may stop at the end-of-messages event, before EOF
+                if not cached and fh.block_offsets_complete():
+                    try:
+                        fh.export_index(str(index))
+                    except OSError:
+                        pass    # read-only data dir: just skip the cache
+
+# ─────────────────────────── native ITCH 5.0 decoder ────────────────────────
+# Messages are framed as a 2-byte big-endian length followed by the body.
+# Every body starts with type(1) stock_locate(2) tracking(2) timestamp(6), so
+# order fields begin at offset 11; see the ITCH 5.0 spec §4 for the layouts.
+_READ_BLOCK = 64 << 20          # bytes per read() for compressed input
+
+_ST_MORE, _ST_FULL, _ST_END, _ST_BAD = 0, 1, 2, 3
+
+@jit(nopython=True, cache=True)
+def _be(data, p, n):
+    """Big-endian unsigned integer of *n* bytes starting at data[p]."""
+    v = np.uint64(0)
+    for k in range(n):
+        v = (v << np.uint64(8)) | np.uint64(data[p + k])
+    return v
+
+@jit(nopython=True, cache=True)
+def _decode_block(data, off, i, u,
+                  ts, oid, side, px, qty, m, stock, u_row, new_oid, new_px, new_qty,
+                  counts, m_code_of, m_types, stock_code_of, stock_keys,
+                  n_codes, sym_key):
+    """Decode framed messages from data[off:] into the buffers from row *i*.
+
+    U-messages also append to the replace buffers from entry *u*.  Returns
+    (off, i, u, status): the first unconsumed byte, the next free row and
+    replace entry, and why decoding stopped (_ST_MORE: incomplete message / end of data,
+    _ST_FULL: buffers full, _ST_END: end-of-messages event, _ST_BAD: framing).
+    """
+    n = data.shape[0]
+    cap = ts.shape[0]
+    while i < cap:
+        if off + 2 > n:
+            return off, i, u, _ST_MORE
+        if data[off] != 0:
+            return off, i, u, _ST_BAD
+        p = off + 2
+        end = p + data[off + 1]
+        if end > n:
+            return off, i, u, _ST_MORE
+        off = end
+
+        t = data[p]
+        counts[t] += 1
+        if t == 83 and data[p + 11] == 67:          # 'S' / 'C': end of messages
+            return off, i, u, _ST_END
+
+        key = np.uint64(0)                          # no stock field → ""
+        oid_v = np.uint64(0)
+        side_v = 255
+        px_v = np.uint64(0)
+        qty_v = np.uint64(0)
+        nid_v = np.uint64(0)
+        if t == 65 or t == 70 or t == 80:           # A, F, P
+            key = _be(data, p + 24, 8)
+            oid_v = _be(data, p + 11, 8)
+            side_v = _SIDE_LUT[data[p + 19]]
+            qty_v = _be(data, p + 20, 4)
+            px_v = _be(data, p + 32, 4)
+        elif t == 81:                               # Q
+            key = _be(data, p + 19, 8)
+            qty_v = _be(data, p + 11, 8)
+        elif t == 69:                               # E
+            oid_v = _be(data, p + 11, 8)
+            qty_v = _be(data, p + 19, 4)
+        elif t == 67:                               # C
+            oid_v = _be(data, p + 11, 8)
+            qty_v = _be(data, p + 19, 4)
+            px_v = _be(data, p + 32, 4)
+        elif t == 88 or t == 68:                    # X, D
+            oid_v = _be(data, p + 11, 8)
+        elif t == 85:                               # U
+            oid_v = _be(data, p + 11, 8)
+            nid_v = _be(data, p + 19, 8)
+            qty_v = _be(data, p + 27, 4)
+            px_v = _be(data, p + 31, 4)
+        else:
+            continue
+        if sym_key != np.uint64(0) and key != sym_key:
+            continue
+
+        ts[i] = _be(data, p + 5, 6)
+        oid[i] = oid_v
+        side[i] = side_v
+        px[i] = px_v
+        qty[i] = qty_v
+        if t == 85:
+            u_row[u] = i
+            new_oid[u] = nid_v
+            new_px[u] = px_v
+            new_qty[u] = qty_v
+            u += 1
+
+        c = m_code_of[t]
+        if c < 0:
+            c = n_codes[0]
+            m_code_of[t] = c
+            m_types[c] = t
+            n_codes[0] += 1
+        m[i] = c
+
+        c = stock_code_of.get(key, -1)
+        if c < 0:
+            c = n_codes[1]
+            stock_code_of[key] = c
+            stock_keys[c] = key
+            n_codes[1] += 1
+        stock[i] = c
+        i += 1
+    return off, i, u, _ST_FULL
+
+def _sym_str(key: int) -> str:
+    """8-byte big-endian symbol key → stripped ticker ('' for no stock field)."""
+    return int(key).to_bytes(8, "big").decode().strip() if key else ""
+
+def _raw_blocks(path: pathlib.Path) -> t.Iterator[t.Any]:
+    """Yield byte blocks of the ITCH stream; blocks may split a message."""
+    if path.suffix == ".gz":
+        with _open_itch(path) as fh:
+            while block := fh.read(_READ_BLOCK):
+                yield block
+    elif path.stat().st_size:           # an empty file cannot be mapped
+        # np.memmap unmaps once the last view is gone, so views handed to the
+        # JIT (which may briefly outlive this frame while compiling) stay valid
+        yield np.memmap(path, np.uint8, mode="r")
+
+def _type_counts(counts: np.ndarray) -> dict[str, int]:
+    """{message type: count} for the nonzero entries of a 256-slot counter."""
+    return {chr(c): int(n) for c, n in enumerate(counts) if n}
+
+def _decode_native(path: pathlib.Path, sym: str | None, buf: ChunkBuffer,
+                   flush: t.Callable) -> tuple[int, int, dict[str, int]]:
+    """Decode with the JIT byte-level decoder; returns (total, kept, counts)."""
+    if sym and len(sym.encode()) > 8:   # ITCH tickers are 8 bytes: matches nothing
+        return 0, 0, {}
+    counts = np.zeros(256, np.int64)
+    m_code_of = np.full(256, -1, np.int16)
+    m_types = np.zeros(256, np.uint8)
+    stock_code_of = NumbaDict.empty(key_type=types.uint64, value_type=types.int64)
+    stock_keys = np.zeros(1 << 16, np.uint64)
+    n_codes = np.zeros(2, np.int64)
+    # uint64 on both sides: mixed signed/unsigned compares go via float64
+    sym_key = np.uint64(int.from_bytes(sym.encode().ljust(8), "big") if sym else 0)
+    m_values: list[str] = []
+    stock_values: list[str] = []
+
+    def columns(b: ChunkBuffer) -> tuple[np.ndarray, ...]:
+        return (b.ts, b.oid, b.side, b.px, b.qty, b.m, b.stock,
+                b.u_row, b.new_oid, b.new_px, b.new_qty)
+
+    def emit(n: int, u: int) -> tuple[np.ndarray, ...]:
+        # extend the decoded intern tables with codes seen since last flush
+        m_values.extend(chr(c) for c in m_types[len(m_values):n_codes[0]])
+        stock_values.extend(_sym_str(k) for k in stock_keys[len(stock_values):n_codes[1]])
+        return columns(flush(n, u, m_values, stock_values))
+
+    cols = columns(buf)
+
+    i = u = kept = 0
+    tail = b""
+    status = _ST_MORE
+    with tqdm(unit="msg", desc="Parsing") as bar:
+        for block in _raw_blocks(path):
+            data = np.frombuffer(tail + block if tail else block, np.uint8)
+            off = 0
+            while True:
+                off, i, u, status = _decode_block(
+                    data, off, i, u, *cols, counts, m_code_of, m_types,
+                    stock_code_of, stock_keys, n_codes, sym_key)
+                bar.update(int(counts.sum()) - bar.n)
+                if status != _ST_FULL:
+                    break
+                kept += i
+                cols = emit(i, u)
+                i = u = 0
+            tail = bytes(data[off:])
+            if status == _ST_BAD:
+                raise ValueError(f"Unexpected start byte in ITCH stream "
+                                 f"({len(tail)} bytes before end of block)")
+            if status == _ST_END:
+                break
+    if i:
+        kept += i
+        emit(i, u)
+    return int(counts.sum()), kept, _type_counts(counts)
+
+# ─────────────────────────── itchfeed reference path ────────────────────────
 def _iter_msgs(fh: t.BinaryIO):
-    yield from MessageParser().read_message_from_file(fh)
+    parser = MessageParser()
+    # itchfeed 1.0.7 has parse_file; fall back to the older read_message_from_file
+    read = getattr(parser, "parse_file", None) or parser.read_message_from_file
+    yield from read(fh)
 
-def decode_itch(path: pathlib.Path, sym: str | None) -> tuple[pa.Table, dict]:
-    """Decode ITCH file and return table + metrics."""
-    ts, oid, side, px, qty, m, stock = [], [], [], [], [], [], []
-    new_oid, new_px, new_qty = [], [], []
-    open_fn = gzip.open if path.suffix == ".gz" else open
-    
-    # Metrics tracking
-    start_time = time.time()
-    total_messages = 0
+def _decode_itchfeed(path: pathlib.Path, sym: str | None, buf: ChunkBuffer,
+                     flush: t.Callable) -> tuple[int, int, dict[str, int]]:
+    """Decode through itchfeed message objects; returns (total, kept, counts)."""
+    i = u = 0
     filtered_messages = 0
-    msg_type_counts = defaultdict(int)
-    bytes_processed = 0
-    parse_start = None
-    
-    # Get file size for throughput calculation
-    file_size = path.stat().st_size
-    
-    with open_fn(path, "rb") as fh:
-        parse_start = time.time()
+    counts = np.zeros(256, np.int64)    # per ITCH type byte, as in _decode_block
+    # intern tables: raw ITCH bytes → code, decoded once on first sight
+    m_codes: dict[bytes, int] = {}
+    m_values: list[str] = []
+    stock_codes: dict[bytes, int] = {}
+    stock_values: list[str] = []
+    sym_raw_want = sym.encode().ljust(8) if sym else None
+
+    with _open_itch(path) as fh:
         for msg in tqdm(_iter_msgs(fh), unit="msg", desc="Parsing"):
-            total_messages += 1
-            msg_type_counts[msg.message_type.decode()] += 1
+            counts[msg.message_type[0]] += 1
             
-            if not isinstance(msg, _ORDER_MSGS):
+            fields = _FIELDS.get(type(msg))
+            if fields is None:
                 continue
                 
             sym_raw = getattr(msg, "stock", b"")
-            sym_str = sym_raw.decode().strip()
-            if sym and sym_str != sym:
+            if sym_raw_want is not None and sym_raw != sym_raw_want:
                 continue
                 
             filtered_messages += 1
-            ts.append(msg.timestamp)
-            oid.append(getattr(msg, "order_reference_number", 0))
-            side.append(_side(msg))
-            px.append(_price(msg))
-            qty.append(_qty(msg))
-            m.append(msg.message_type.decode())
-            stock.append(sym_str)
-
-            if isinstance(msg, OrderReplaceMessage):
-                new_oid.append(msg.new_order_reference_number)
-                new_px.append(msg.price)
-                new_qty.append(msg.shares)
-            else:
-                new_oid.append(0)
-                new_px.append(0)
-                new_qty.append(0)
+            pxf, qf, has_side = fields
+            buf.ts[i]   = msg.timestamp
+            buf.oid[i]  = getattr(msg, "order_reference_number", 0)
+            buf.side[i] = _SIDE_OF[msg.buy_sell_indicator[0]] if has_side else 255
+            buf.px[i]   = getattr(msg, pxf) if pxf else 0
+            buf.qty[i]  = getattr(msg, qf) if qf else 0
+
+            mt = msg.message_type
+            code = m_codes.get(mt)
+            if code is None:
+                code = m_codes[mt] = len(m_values)
+                m_values.append(mt.decode())
+            buf.m[i] = code
+
+            code = stock_codes.get(sym_raw)
+            if code is None:
+                code = stock_codes[sym_raw] = len(stock_values)
+                stock_values.append(sym_raw.decode().strip())
+            buf.stock[i] = code
+
+            if type(msg) is OrderReplaceMessage:
+                buf.u_row[u]   = i
+                buf.new_oid[u] = msg.new_order_reference_number
+                buf.new_px[u]  = msg.price
+                buf.new_qty[u] = msg.shares
+                u += 1
+
+            i += 1
+            if i == buf.size:
+                buf = flush(i, u, m_values, stock_values)
+                i = u = 0
+
+    if i:
+        flush(i, u, m_values, stock_values)
+    return int(counts.sum()), filtered_messages, _type_counts(counts)
+
+# ─────────────────────────────  main decoder  ───────────────────────────────
+_DECODERS = {"native": _decode_native, "itchfeed": _decode_itchfeed}
+
+def decode_itch(path: pathlib.Path, out: pathlib.Path, sym: str | None,
+                row_group: int = CHUNK, parser: str = "native") -> dict:
+    """Decode ITCH file, stream row groups to *out* and return metrics.
+
+    Parquet encoding runs on a writer thread (it releases the GIL while
+    compressing) fed through a small pool of ChunkBuffers: a flush hands
+    the filled buffer over and blocks until a written one comes back.
+    """
+    free: queue.Queue[ChunkBuffer] = queue.Queue()
+    for _ in range(WRITE_BUFFERS):
+        free.put(ChunkBuffer(row_group))
+    pending: queue.Queue[tuple | None] = queue.Queue()
+    rows_written = 0
+    write_time = 0.0
+    write_error: BaseException | None = None
+    
+    # Metrics tracking
+    start_time = time.time()
+    
+    # Get file size for throughput calculation
+    file_size = path.stat().st_size
+    
+    writer = pq.ParquetWriter(
+        out, SCHEMA,
+        compression="zstd", use_dictionary=True, data_page_size=1 << 20,
+    )
+    replace_writer = pq.ParquetWriter(
+        replace_path(out), REPLACE_SCHEMA, compression="zstd",
+    )
+
+    def write_loop() -> None:
+        # write_batch encodes synchronously, so the buffer is reusable after
+        nonlocal write_time, write_error
+        for batch, replaces, used in iter(pending.get, None):
+            if write_error is None:
+                try:
+                    w0 = time.time()
+                    writer.write_batch(batch, row_group_size=row_group)
+                    if replaces is not None:
+                        replace_writer.write_batch(replaces)
+                    write_time += time.time() - w0
+                except BaseException as e:      # re-raised by the decoding thread
+                    write_error = e
+            del batch, replaces
+            free.put(used)
 
+    def flush(n: int, u: int, m_values: list[str],
+              stock_values: list[str]) -> ChunkBuffer:
+        # queue the filled buffer's rows; returns the buffer to decode into next
+        nonlocal rows_written, buf
+        if write_error is not None:
+            raise write_error
+        pending.put((buf.to_batch(n, m_values, stock_values),
+                     buf.replace_batch(u, rows_written) if u else None, buf))
+        rows_written += n
+        buf = free.get()
+        return buf
+
+    buf = free.get()
+    writer_thread = threading.Thread(target=write_loop, name="parquet-writer")
+    writer_thread.start()
+    failed = True
+    try:
+        parse_start = time.time()
+        total_messages, filtered_messages, msg_type_counts = \
+            _DECODERS[parser](path, sym, buf, flush)
+        failed = False
+    finally:
+        pending.put(None)
+        writer_thread.join()
+        writer.close()
+        replace_writer.close()
+        # never leave a truncated (or empty) file pair behind
+        if failed or write_error is not None or not rows_written:
+            out.unlink(missing_ok=True)
+            replace_path(out).unlink(missing_ok=True)
+    if write_error is not None:
+        raise write_error
     parse_end = time.time()
     
-    if not ts:
+    if not rows_written:
         sys.exit("✖  No rows — wrong file or overly strict symbol filter.")
 
-    # Build table
-    table_start = time.time()
-    table = pa.Table.from_pydict(
-        {
-            "ts":       pa.array(ts,      pa.uint64()),
-            "oid":      pa.array(oid,     pa.uint64()),
-            "side":     pa.array(side,    pa.uint8()),
-            "px":       pa.array(px,      pa.uint32()),
-            "qty":      pa.array(qty,     pa.uint32()),
-            "m":        pa.array(m,       pa.string()),
-            "stock":    pa.array(stock,   pa.string()),
-            "new_oid":  pa.array(new_oid, pa.uint64()),
-            "new_px":   pa.array(new_px,  pa.uint32()),
-            "new_qty":  pa.array(new_qty, pa.uint32()),
-        }
-    )
-    table_end = time.time()
-    
     # Calculate metrics
     parse_time = parse_end - parse_start
-    table_time = table_end - table_start
     total_time = parse_end - start_time
     
     metrics = {
         'total_time': total_time,
         'parse_time': parse_time,
-        'table_creation_time': table_time,
+        'write_time': write_time,
         'total_messages': total_messages,
         'filtered_messages': filtered_messages,
+        'rows_written': rows_written,
         'messages_per_second': total_messages / parse_time if parse_time > 0 else 0,
         'filtered_msgs_per_second': filtered_messages / parse_time if parse_time > 0 else 0,
         'file_size_mb': file_size / (1024 * 1024),
         'throughput_mbps': (file_size / (1024 * 1024)) / parse_time if parse_time > 0 else 0,
         'filter_ratio': filtered_messages / total_messages if total_messages > 0 else 0,
-        'msg_type_counts': dict(msg_type_counts),
+        'msg_type_counts': msg_type_counts,
         'avg_msg_size': file_size / total_messages if total_messages > 0 else 0,
     }
     
-    return table, metrics
+    return metrics
 
-def print_metrics(metrics: dict, output_path: pathlib.Path, table_rows: int) -> None:
+def print_metrics(metrics: dict, output_path: pathlib.Path) -> None:
     """Print comprehensive performance metrics."""
     print(f"\n{'='*60}")
     print(f"📊 PERFORMANCE METRICS")
@@ -193,7 +640,7 @@ def print_metrics(metrics: dict, output_path: pathlib.Path, table_rows: int) ->
     print(f"⏱️  TIMING:")
     print(f"   Total time:           {metrics['total_time']:.2f}s")
     print(f"   Parse time:           {metrics['parse_time']:.2f}s")
-    print(f"   Table creation:       {metrics['table_creation_time']:.2f}s")
+    print(f"   Parquet write:        {metrics['write_time']:.2f}s (within parse)")
     
     print(f"\n📈 THROUGHPUT:")
     print(f"   Messages/sec:         {metrics['messages_per_second']:,.0f}")
@@ -221,20 +668,132 @@ def print_metrics(metrics: dict, output_path: pathlib.Path, table_rows: int) ->
         print(f"   {msg_type:>3}: {count:>8,} ({pct:>5.1f}%)")
     
     print(f"\n✅ OUTPUT:")
-    print(f"   Parquet rows:         {table_rows:,}")
+    print(f"   Parquet rows:         {metrics['rows_written']:,}")
     print(f"={'='*60}")
 
+# ───────────────────────────── parser self-check ────────────────────────────
+# ITCH 5.0 body layouts after the type byte (locate, tracking, ts_hi, ts_lo, …)
+_SYNTH_FMT = {
+    b"A": "!HHHIQcI8sI",   b"F": "!HHHIQcI8sI4s", b"E": "!HHHIQIQ",
+    b"C": "!HHHIQIQcI",    b"X": "!HHHIQI",       b"D": "!HHHIQ",
+    b"U": "!HHHIQQII",     b"P": "!HHHIQcI8sIQ",  b"Q": "!HHHIQ8sIQc",
+    b"S": "!HHHIc",
+}
+
+def _synthetic_session(n: int = 20_000, seed: int = 0) -> bytes:
+    """Framed ITCH session of *n* random order-flow messages over a few tickers."""
+    rnd = random.Random(seed)
+    syms = [s.encode().ljust(8) for s in ("AAPL", "MSFT", "IBM", "A")]
+    out = bytearray()
+    ts = 34_200 * 10**9                 # 09:30, past 2³² so ts_hi is exercised
+
+    def put(mt: bytes, *fields) -> None:
+        nonlocal ts
+        ts += rnd.randint(1, 10_000)
+        body = mt + struct.pack(_SYNTH_FMT[mt], 1, 0, ts >> 32, ts & 0xFFFFFFFF, *fields)
+        out.extend(struct.pack("!H", len(body)) + body)
+
+    def px() -> int:
+        return rnd.randint(100, 120) * 100
+
+    live: list[int] = []
+    next_oid = 1
+    put(b"S", b"O")
+    for _ in range(n):
+        r = rnd.random()
+        if r < 0.35 or not live:
+            side, sym = rnd.choice(b"BS").to_bytes(1, "big"), rnd.choice(syms)
+            if r < 0.3:
+                put(b"A", next_oid, side, rnd.randint(1, 500), sym, px())
+            else:
+                put(b"F", next_oid, side, rnd.randint(1, 500), sym, px(), b"MPID")
+            live.append(next_oid)
+            next_oid += 1
+        elif r < 0.50:
+            put(b"E", rnd.choice(live), rnd.randint(1, 300), next_oid)
+        elif r < 0.55:
+            put(b"C", rnd.choice(live), rnd.randint(1, 300), next_oid, b"Y", px())
+        elif r < 0.65:
+            put(b"X", rnd.choice(live), rnd.randint(1, 100))
+        elif r < 0.75:
+            put(b"D", live.pop(rnd.randrange(len(live))))
+        elif r < 0.85:
+            put(b"U", live.pop(rnd.randrange(len(live))), next_oid,
+                rnd.randint(1, 500), px())
+            live.append(next_oid)
+            next_oid += 1
+        elif r < 0.90:
+            put(b"P", 0, rnd.choice(b"BS").to_bytes(1, "big"), rnd.randint(1, 100),
+                rnd.choice(syms), px(), next_oid)
+        elif r < 0.92:
+            put(b"Q", rnd.randint(1, 1000), rnd.choice(syms), px(), next_oid, b"O")
+        else:
+            put(b"S", b"Q")
+    put(b"S", b"C")
+    return bytes(out)
+
+def _read_pair(out: pathlib.Path) -> dict[str, pa.ChunkedArray]:
+    """Columns of *out* and its sidecar, dictionaries decoded to strings."""
+    cols = {}
+    for path in (out, replace_path(out)):
+        table = pq.read_table(path)
+        for name in table.column_names:
+            col = table.column(name)
+            if pa.types.is_dictionary(col.type):
+                col = col.cast(pa.string())
+            cols[f"{path.name.split('.', 1)[1]}:{name}"] = col
+    return cols
+
+def self_check(n: int = 20_000) -> bool:
+    """Decode a synthetic session with every parser and compare the columns.
+
+    Runs raw and .gz input, unfiltered and with --symbol, through a small
+    --row-group so row groups and sidecar row offsets are exercised too.
+    """
+    data = _synthetic_session(n)
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = pathlib.Path(tmp)
+        (tmp / "s.itch").write_bytes(data)
+        with gzip.open(tmp / "s.itch.gz", "wb") as fh:
+            fh.write(data)
+        for src in ("s.itch", "s.itch.gz"):
+            for sym in (None, "AAPL"):
+                got = {}
+                for parser in _DECODERS:
+                    out = tmp / f"{parser}.parquet"
+                    decode_itch(tmp / src, out, sym, 4096, parser)
+                    got[parser] = _read_pair(out)
+                ref = got.pop("native")
+                bad = [f"{parser}:{c}" for parser, cols in got.items()
+                       for c in ref.keys() | cols.keys()
+                       if c not in ref or c not in cols or not ref[c].equals(cols[c])]
+                ok &= not bad
+                print(f"{'✖' if bad else '✓'}  {src} symbol={sym}: "
+                      f"{len(ref['parquet:ts']):,} rows, "
+                      f"{len(ref['replace.parquet:row']):,} replaces"
+                      + (f" — differs in {', '.join(sorted(bad))}" if bad else ""))
+    return ok
+
 # ────────────────────────────────  CLI  ─────────────────────────────────────
 def main() -> None:
     ap = argparse.ArgumentParser()
-    ap.add_argument("itch_file",   type=pathlib.Path,
+    ap.add_argument("itch_file",   type=pathlib.Path, nargs="?",
                     help="ITCH 5.0 session (.gz or raw)")
-    ap.add_argument("out_parquet", type=pathlib.Path,
+    ap.add_argument("out_parquet", type=pathlib.Path, nargs="?",
                     help="Destination parquet file")
     ap.add_argument("--symbol", help="Filter to single ticker (optional)")
     ap.add_argument("--row-group", type=int, default=1_000_000,
                     help="Parquet row-group size (default 1 M)")
+    ap.add_argument("--parser", choices=sorted(_DECODERS), default="native",
+                    help="Message decoder (default native)")
+    ap.add_argument("--self-check", action="store_true",
+                    help="Compare the parsers on a synthetic session and exit")
     args = ap.parse_args()
+    if args.self_check:
+        sys.exit(0 if self_check() else 1)
+    if args.out_parquet is None:
+        ap.error("itch_file and out_parquet are required")
 
     print(f"🚀 Starting ITCH→Parquet conversion...")
     print(f"   Input:  {args.itch_file}")
@@ -242,22 +801,14 @@ def main() -> None:
     if args.symbol:
         print(f"   Symbol: {args.symbol}")
     
-    # Decode with metrics
-    table, metrics = decode_itch(args.itch_file, args.symbol)
-    
-    # Write parquet file
-    write_start = time.time()
-    pq.write_table(
-        table, args.out_parquet,
-        compression="zstd", use_dictionary=True,
-        data_page_size=1 << 20, row_group_size=args.row_group,
-    )
-    write_time = time.time() - write_start
+    # Decode + stream row groups to disk
+    metrics = decode_itch(args.itch_file, args.out_parquet, args.symbol,
+                          args.row_group, args.parser)
     
-    print(f"✓  Parquet write completed in {write_time:.2f}s")
+    print(f"✓  Parquet write completed in {metrics['write_time']:.2f}s")
     
     # Print comprehensive metrics
-    print_metrics(metrics, args.out_parquet, table.num_rows)
+    print_metrics(metrics, args.out_parquet)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -49,11 +49,17 @@
 //   side:uint8       - 0=bid, 1=ask
 //   px:uint32        - price
 //   qty:uint32       - quantity
-//   m:string         - message type ("A"=add, "C"=cancel, "E"=execute, "U"=replace)
-//   stock:string     - symbol
-//   new_oid:uint64   - new order ID (for replace messages)
-//   new_px:uint32    - new price (for replace messages)
-//   new_qty:uint32   - new quantity (for replace messages)
+//   m:dictionary<uint8,string>      - message type ("A"=add, "C"=cancel, "E"=execute, "U"=replace)
+//   stock:dictionary<uint16,string> - symbol
+// (plain string m/stock columns, as older converters wrote them, also work)
+//
+// Replace details sit in the <name>.replace.parquet sidecar, one row per "U":
+//   row:uint64       - index of the replace message in the main file
+//   new_oid:uint64   - new order ID
+//   new_px:uint32    - new price
+//   new_qty:uint32   - new quantity
+// Files from older converters carry new_oid/new_px/new_qty inline in the main
+// table instead; those are used directly and no sidecar is opened.
 //
 // PERFORMANCE NOTES:
 // ======================================================================
@@ -76,6 +82,7 @@
 #include <cstring>
 #include <algorithm>
 #include <string_view>
+#include <filesystem>
 
 // ──────────────────────────── Order‑book structs ──────────────────────
 struct Order {
@@ -123,9 +130,16 @@ struct OrderBook {
     inline void replace(uint64_t oid, uint64_t new_oid, uint32_t new_px, uint32_t new_qty) {
         auto it = live.find(oid);
         if (it == live.end()) return;
-        uint8_t side = it->second.side;
-        cancel(oid);
-        add(new_oid, side, new_px, new_qty);
+        const Order old = it->second;                   // cancel + add, one lookup
+        live.erase(it);
+        auto &lvl = (old.side == 0 ? bid_size : ask_size);
+        auto lit  = lvl.find(old.px);
+        if (lit != lvl.end()) {
+            lit->second -= old.qty;
+            if (lit->second == 0) lvl.erase(lit);
+        }
+        live.emplace(new_oid, Order{new_oid, new_px, new_qty, old.side});
+        lvl[new_px] += new_qty;
     }
 };
 
@@ -134,17 +148,9 @@ static inline uint64_t rdtsc() {
     return __builtin_readcyclecounter(); // works on x86‑64 & Apple‑silicon
 }
 
-// ─────────────────────────────────── Main Application ─────────────────────────────
-int main(int argc, char **argv) {
-    if (argc != 2) {
-        std::cerr << "Usage: ./lob_replay <bx_YYYYMMDD.parquet>\n";
-        return 1;
-    }
-
-    // 1. Open Parquet file and initialize Arrow reader ----------------------
-    auto maybe_infile = arrow::io::ReadableFile::Open(argv[1]);
-    if (!maybe_infile.ok()) { std::cerr << maybe_infile.status() << '\n'; return 1; }
-    std::shared_ptr<arrow::io::RandomAccessFile> infile = *maybe_infile;
+// ───────────────────────────── Parquet → single‑chunk table ─────────────────
+static std::shared_ptr<arrow::Table> read_parquet(const std::string &path) {
+    PARQUET_ASSIGN_OR_THROW(auto infile, arrow::io::ReadableFile::Open(path));
 
     parquet::ReaderProperties pq_props(arrow::default_memory_pool());
     std::unique_ptr<parquet::ParquetFileReader> pq_reader = parquet::ParquetFileReader::Open(infile, pq_props);
@@ -156,6 +162,48 @@ int main(int argc, char **argv) {
     std::shared_ptr<arrow::Table> table;
     PARQUET_THROW_NOT_OK(reader->ReadTable(&table));
     PARQUET_ASSIGN_OR_THROW(table, table->CombineChunks(arrow::default_memory_pool()));
+    return table;
+}
+
+// ───────────────────── m / stock: dictionary or plain strings ──────────────
+// The current converter dictionary-encodes them; older ones wrote plain strings.
+static bool string_column(const std::shared_ptr<arrow::Array> &col,
+                          std::shared_ptr<arrow::DictionaryArray> &codes,
+                          std::shared_ptr<arrow::StringArray> &values,
+                          std::shared_ptr<arrow::StringArray> &plain) {
+    if (col->type_id() == arrow::Type::DICTIONARY) {
+        codes  = std::static_pointer_cast<arrow::DictionaryArray>(col);
+        values = std::static_pointer_cast<arrow::StringArray>(codes->dictionary());
+    } else if (col->type_id() == arrow::Type::STRING) {
+        plain  = std::static_pointer_cast<arrow::StringArray>(col);
+    } else {
+        std::cerr << "expected string or dictionary<string> column, got "
+                  << col->type()->ToString() << '\n';
+        return false;
+    }
+    return true;
+}
+
+// ─────────────────────────────────── Main Application ─────────────────────────────
+int main(int argc, char **argv) {
+    if (argc != 2) {
+        std::cerr << "Usage: ./lob_replay <bx_YYYYMMDD.parquet>\n";
+        return 1;
+    }
+
+    // 1. Read the message table and its replace sidecar ---------------------
+    std::shared_ptr<arrow::Table> table, replaces;
+    bool inline_u = false;                          // older files: no sidecar
+    try {
+        table    = read_parquet(argv[1]);
+        inline_u = table->schema()->GetFieldIndex("new_oid") >= 0;
+        replaces = inline_u ? table
+                            : read_parquet(std::filesystem::path(argv[1])
+                                               .replace_extension(".replace.parquet").string());
+    } catch (const std::exception &e) {
+        std::cerr << e.what() << '\n';
+        return 1;
+    }
 
     const int64_t rows = table->num_rows();
 
@@ -167,26 +215,38 @@ int main(int argc, char **argv) {
     auto qty_col     = table->GetColumnByName("qty")->chunk(0);
     auto m_col       = table->GetColumnByName("m")->chunk(0);
     auto stock_col   = table->GetColumnByName("stock")->chunk(0);
-    auto new_oid_col = table->GetColumnByName("new_oid")->chunk(0);
-    auto new_px_col  = table->GetColumnByName("new_px")->chunk(0);
-    auto new_qty_col = table->GetColumnByName("new_qty")->chunk(0);
+    auto u_row_col   = inline_u ? nullptr : replaces->GetColumnByName("row")->chunk(0);
+    auto new_oid_col = replaces->GetColumnByName("new_oid")->chunk(0);
+    auto new_px_col  = replaces->GetColumnByName("new_px")->chunk(0);
+    auto new_qty_col = replaces->GetColumnByName("new_qty")->chunk(0);
 
     auto ts_arr      = std::static_pointer_cast<arrow::UInt64Array>(ts_col);
     auto oid_arr     = std::static_pointer_cast<arrow::UInt64Array>(oid_col);
     auto side_arr    = std::static_pointer_cast<arrow::UInt8Array >(side_col);
     auto px_arr      = std::static_pointer_cast<arrow::UInt32Array>(px_col);
     auto qty_arr     = std::static_pointer_cast<arrow::UInt32Array>(qty_col);
-    auto m_arr       = std::static_pointer_cast<arrow::StringArray>(m_col);
-    auto stock_arr   = std::static_pointer_cast<arrow::StringArray>(stock_col);
+    std::shared_ptr<arrow::DictionaryArray> m_arr, stock_arr;   // set for dictionary columns
+    std::shared_ptr<arrow::StringArray> m_dict, stock_dict;     //   … with their values
+    std::shared_ptr<arrow::StringArray> m_str, stock_str;       // set for plain string columns
+    if (!string_column(m_col, m_arr, m_dict, m_str) ||
+        !string_column(stock_col, stock_arr, stock_dict, stock_str))
+        return 1;
+    auto u_row_arr   = std::static_pointer_cast<arrow::UInt64Array>(u_row_col);
     auto new_oid_arr = std::static_pointer_cast<arrow::UInt64Array>(new_oid_col);
     auto new_px_arr  = std::static_pointer_cast<arrow::UInt32Array>(new_px_col);
     auto new_qty_arr = std::static_pointer_cast<arrow::UInt32Array>(new_qty_col);
 
-    // 3. Initialize per‑symbol order books -----------------------------------
-    std::unordered_map<std::string, OrderBook> books;
-    books.reserve(256);
+    // 3. One order book per stock dictionary code (or per distinct string) ---
+    std::vector<OrderBook> books(stock_dict ? stock_dict->length() : 0);
+    std::unordered_map<std::string_view, size_t> book_of;   // string stock only
+    auto book_for = [&](std::string_view sym) -> OrderBook & {
+        auto [it, fresh] = book_of.try_emplace(sym, books.size());
+        if (fresh) books.emplace_back();
+        return books[it->second];
+    };
 
     std::vector<uint64_t> latencies; latencies.reserve(rows);
+    int64_t u = 0;                                  // next sidecar row
 
     // 4. Execute order book replay with per-message latency tracking ---------
     const auto wall_t0 = std::chrono::steady_clock::now();
@@ -199,10 +259,10 @@ int main(int argc, char **argv) {
         uint8_t  side = side_arr->Value(i);
         uint32_t px   = px_arr->Value(i);
         uint32_t qty  = qty_arr->Value(i);
-        std::string_view m_type = m_arr->GetView(i);     // "A", "C", "E", "U" …
-        const std::string &sym  = stock_arr->GetString(i);
-
-        OrderBook &ob = books.emplace(sym, OrderBook{}).first->second;
+        std::string_view m_type = m_arr ? m_dict->GetView(m_arr->GetValueIndex(i))
+                                        : m_str->GetView(i);                // "A", "C", "E", "U" …
+        OrderBook &ob = stock_arr ? books[stock_arr->GetValueIndex(i)]      // no string hashing
+                                  : book_for(stock_str->GetView(i));
 
         if (m_type == "A") {
             ob.add(oid, side, px, qty);
@@ -211,9 +271,17 @@ int main(int argc, char **argv) {
         } else if (m_type == "E") {
             ob.execute(oid, qty);
         } else if (m_type == "U") {
-            uint64_t new_oid = new_oid_arr->Value(i);
-            uint32_t new_px  = new_px_arr->Value(i);
-            uint32_t new_qty = new_qty_arr->Value(i);
+            int64_t r = i;                          // inline: same row
+            if (!inline_u) {
+                if (u == replaces->num_rows() || u_row_arr->Value(u) != uint64_t(i)) {
+                    std::cerr << "replace sidecar out of step at row " << i << '\n';
+                    return 1;
+                }
+                r = u++;
+            }
+            uint64_t new_oid = new_oid_arr->Value(r);
+            uint32_t new_px  = new_px_arr->Value(r);
+            uint32_t new_qty = new_qty_arr->Value(r);
             ob.replace(oid, new_oid, new_px, new_qty);
         }
 